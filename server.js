@@ -22,6 +22,7 @@
  * - GET  /api/logs                → Obtener logs completos (requiere token)
  * - GET  /api/logs/stream         → Stream de logs en tiempo real vía SSE (requiere token)
  * - GET  /api/sessions            → Listar sesiones activas
+ * - GET  /api/flow-audit          → Reporte de auditoría (?sessionIds=a,b → auditorías por sesión en JSON)
  *
  * Notes:
  * - Requires a sessionStore.js that implements getSession, saveSession, listActiveSessions
@@ -11041,9 +11042,30 @@ app.get('/api/flow-audit/:sessionId', (req, res) => {
   }
 });
 
-// Get full audit report
+// Get full audit report, or several session audits in one call (?sessionIds=a,b,c)
+const MAX_FLOW_AUDIT_BATCH = 50;
 app.get('/api/flow-audit', (req, res) => {
   try {
+    if (req.query.sessionIds !== undefined) {
+      const sessionIds = String(req.query.sessionIds).split(',').map(s => s.trim()).filter(Boolean);
+
+      // Validación: lista acotada de sessionIds seguros
+      if (sessionIds.length === 0 || sessionIds.length > MAX_FLOW_AUDIT_BATCH) {
+        return badRequest(res, 'BAD_SESSION_IDS', `Se esperan entre 1 y ${MAX_FLOW_AUDIT_BATCH} sessionIds`);
+      }
+      if (!sessionIds.every(isSafeId)) {
+        return badRequest(res, 'BAD_SESSION_ID', 'Session ID inválido');
+      }
+
+      // Resumen por sesión: sin los logs crudos (usar /api/flow-audit/:sessionId para verlos)
+      const audits = {};
+      for (const sessionId of sessionIds) {
+        const { logs, ...summary } = getSessionAudit(sessionId);
+        audits[sessionId] = summary;
+      }
+      return res.json({ ok: true, audits });
+    }
+
     const report = generateAuditReport();
     res.setHeader('Content-Type', 'text/markdown');
     res.send(report);